@@ -1,9 +1,18 @@
 # Functions here have no dependencies outside the Python Standard Library
+import array
+import gzip
 import hashlib
+import mmap
 import os
 import pickle
 import random
+import threading
 import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from functools import lru_cache, partial
+from operator import itemgetter
 from pathlib import Path
 from typing import Any, BinaryIO, Callable, List, Optional
 
@@ -11,6 +20,16 @@ from typing import Any, BinaryIO, Callable, List, Optional
 ################################################
 
 
+# Number of files found by find_nbr_of_files, per (directory, extension), together with
+# the modification time of the directory when they were counted
+_file_count_cache = OrderedDict()
+_file_count_cache_lock = threading.Lock()
+_FILE_COUNT_CACHE_SIZE = 128
+# Counts of directories modified less than this long before they were scanned are not
+# cached, since later changes may not move a coarse modification time (e.g. FAT's 2 s)
+_RACY_MTIME_NS = 5 * 10**9
+
+
 def find_nbr_of_files(directory, extension=None):
     """Find the number of files in a directory
 
@@ -26,17 +45,40 @@ def find_nbr_of_files(directory, extension=None):
     ------------
     n : int
         Number of files in directory
+
+    Notes
+    ------------
+    Counts are cached along with the modification time of the directory, and the
+    directory is only rescanned once its modification time changes. Like git's racy
+    timestamp rule, counts of directories modified within a few seconds of the scan
+    are not cached, since changes made right after the scan may leave a coarse
+    modification time unchanged.
     """
     extension = tuple(extension) if type(extension) == list else extension
 
-    n = 0
-    for filename in os.listdir(directory):
-        if os.path.isfile(os.path.join(directory, filename)):
-            if extension is not None:
-                if filename.endswith(extension):
-                    n += 1
-            else:
-                n += 1
+    key = (directory, extension)
+    scan_time = time.time_ns()
+    mtime = os.stat(directory).st_mtime_ns
+    with _file_count_cache_lock:
+        cached = _file_count_cache.get(key)
+        if cached is not None and cached[0] == mtime:
+            _file_count_cache.move_to_end(key)
+            return cached[1]
+
+    with os.scandir(directory) as entries:
+        n = sum(
+            1
+            for entry in entries
+            if (extension is None or entry.name.endswith(extension)) and entry.is_file()
+        )
+    with _file_count_cache_lock:
+        if scan_time - mtime < _RACY_MTIME_NS:
+            _file_count_cache.pop(key, None)
+            return n
+        _file_count_cache[key] = (mtime, n)
+        _file_count_cache.move_to_end(key)
+        if len(_file_count_cache) > _FILE_COUNT_CACHE_SIZE:
+            _file_count_cache.popitem(last=False)
     return n
 
 
@@ -63,21 +105,112 @@ def list_files(directory, extension=None, include_dir=False):
     extension = tuple(extension) if type(extension) == list else extension
 
     files = []
-    for filename in os.listdir(directory):
-        if os.path.isfile(os.path.join(directory, filename)):
-            if extension is not None:
-                if not filename.endswith(extension):
-                    continue
-            if include_dir:
-                filepath = os.path.join(directory, filename)
-            else:
-                filepath = filename
-            files.append(filepath)
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file():
+                if extension is not None:
+                    if not entry.name.endswith(extension):
+                        continue
+                files.append(entry.path if include_dir else entry.name)
     return files
 
 
-# include_dir=True => include directory in paths # TODO: Implement this, now we always have include_dir=True functionality
-def list_files_recursive(directory, extension=None, include_dir=False):
+def _scan_dir(root, extension, include_dir, rel):
+    """Scan a single directory for files ending with 'extension'
+
+    Returns the paths of the matching files in 'root' and (path, rel) pairs for its
+    subdirectories. Paths are either full paths (include_dir=True) or relative to the
+    directory the walk started in, built from the running prefix 'rel'.
+    Unreadable directories are treated as empty, like os.walk does.
+    """
+    files, subdirs = [], []
+    try:
+        with os.scandir(root) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append((entry.path, rel + entry.name + os.sep))
+                elif entry.is_file() and entry.name.endswith(extension):
+                    files.append(entry.path if include_dir else rel + entry.name)
+    except OSError:
+        pass
+    return files, subdirs
+
+
+def _walk(root, extension, include_dir, rel=""):
+    """Recursively yield paths of files in 'root' ending with 'extension'"""
+    files, subdirs = _scan_dir(root, extension, include_dir, rel)
+    yield from files
+    for path, subdir_rel in subdirs:
+        yield from _walk(path, extension, include_dir, subdir_rel)
+
+
+# Below this number of pending directories, thread start-up costs more than it saves
+_MIN_PARALLEL_SUBDIRS = 4
+
+
+def _walk_parallel(root, extension, include_dir, workers):
+    """Return paths of files in 'root' ending with 'extension', scanning directories in 'workers' threads"""
+    files, subdirs = _scan_dir(root, extension, include_dir, "")
+    # Descend level by level until enough directories are pending to share between the
+    # threads, e.g. through 'root/data' to the many directories in it
+    while 0 < len(subdirs) < _MIN_PARALLEL_SUBDIRS:
+        level, subdirs = subdirs, []
+        for path, rel in level:
+            dir_files, dir_subdirs = _scan_dir(path, extension, include_dir, rel)
+            files.extend(dir_files)
+            subdirs.extend(dir_subdirs)
+    if not subdirs:
+        return files
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {
+            executor.submit(_scan_dir, path, extension, include_dir, rel)
+            for path, rel in subdirs
+        }
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                dir_files, dir_subdirs = future.result()
+                files.extend(dir_files)
+                pending.update(
+                    executor.submit(_scan_dir, path, extension, include_dir, rel)
+                    for path, rel in dir_subdirs
+                )
+    return files
+
+
+def iter_files_recursive(directory, extension=None, include_dir=False):
+    """Lazily iterate over paths in a directory and its subdirectories
+
+    Parameters
+    -------------
+    directory : string
+        path to directory
+    extension : string or list/tuple of string
+        Only include files ending with string(s) specified by extension.
+        extension==None (default) means all files will be included.
+    include_dir : bool
+        True => Prepend filenames with directory path for each file
+
+    Yields
+    -----------------
+    file : string
+        path of a file in directory or one of its subdirectories
+
+    Notes
+    -----------------
+    Paths are yielded in directory traversal order, one directory at a time, so the
+    full listing is never held in memory.
+    """
+    extension = "" if extension is None else extension
+    extension = tuple(extension) if type(extension) == list else extension
+
+    return _walk(directory, extension, include_dir)
+
+
+def list_files_recursive(
+    directory, extension=None, include_dir=False, sort=False, workers=1
+):
     """Return list of paths in a directory and its subdirectories
 
     Parameters
@@ -88,25 +221,34 @@ def list_files_recursive(directory, extension=None, include_dir=False):
         Only include files ending with string(s) specified by extension.
         extension==None (default) means all files will be counted.
     include_dir : bool
-        (ONLY TRUE WORKS ATM) True => Prepend filenames with directory path for each file
+        True => Prepend filenames with directory path for each file
+    sort : bool
+        True => Sort the returned paths. Default is traversal order.
+    workers : int
+        Number of threads scanning subdirectories concurrently. Default is a
+        sequential scan.
 
     Returns
     -----------------
     files : list of string
         list of files in directory and its subdirectories
 
+    Notes
+    -----------------
+    - workers > 1 pays off on high-latency file systems (NFS, SMB, ...), where the
+      scan is dominated by metadata round trips. Threads are only started once the
+      scan reaches a level with several directories, so trees that never branch out
+      are scanned sequentially regardless.
+    - (DEPENDS) barktools.base_utils.iter_files_recursive
     """
-    extension = "" if extension is None else extension
-    extension = tuple(extension) if type(extension) == list else extension
-
-    files = [
-        os.path.join(root, file)
-        for root, _, files in os.walk(directory)
-        for file in files
-        if file.endswith(extension)
-    ]
-    if not include_dir:
-        files = [file.replace(directory + os.sep, "") for file in files]
+    if workers > 1:
+        extension = "" if extension is None else extension
+        extension = tuple(extension) if type(extension) == list else extension
+        files = _walk_parallel(directory, extension, include_dir, workers)
+    else:
+        files = list(iter_files_recursive(directory, extension, include_dir))
+    if sort:
+        files.sort()
     return files
 
 
@@ -126,17 +268,75 @@ def change_num_format(directory, extension=None, n_leading_zeros=5):
     """
     extension = tuple(extension) if type(extension) == list else extension
 
-    for filename in os.listdir(directory):
-        if extension is not None:
-            if filename.endswith(extension):
-                filename_no_ext = os.path.splitext(filename)[0]
-                this_extension = os.path.splitext(filename)[1]
-                try:
-                    num = int(filename_no_ext)
-                    new_filename = str(num).zfill(n_leading_zeros) + this_extension
-                    os.rename(filename, new_filename)
-                except ValueError:
-                    pass
+    renames = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if extension is not None:
+                if entry.name.endswith(extension):
+                    filename_no_ext, this_extension = os.path.splitext(entry.name)
+                    try:
+                        num = int(filename_no_ext)
+                        new_filename = str(num).zfill(n_leading_zeros) + this_extension
+                        renames.append((entry.name, new_filename))
+                    except ValueError:
+                        pass
+    rename_batch(directory, renames)
+
+
+@contextmanager
+def directory_renamer(directory):
+    """Context manager yielding a function which renames files within a directory
+
+    Parameters
+    ---------------
+    directory : string
+        Path to directory
+
+    Yields
+    ---------------
+    rename : callable
+        rename(filename, new_filename) renames a file in directory. Safe to call from
+        several threads until the context is exited.
+
+    Notes
+    ---------------
+    Where the platform supports it, the directory is opened once and every rename is
+    resolved relative to it (renameat), instead of looking up the directory path
+    twice per rename. Elsewhere, files are renamed by their full paths.
+    """
+    if os.rename in os.supports_dir_fd:
+        dir_fd = os.open(directory, os.O_RDONLY | getattr(os, "O_DIRECTORY", 0))
+        try:
+            yield partial(os.rename, src_dir_fd=dir_fd, dst_dir_fd=dir_fd)
+        finally:
+            os.close(dir_fd)
+    else:
+
+        def rename(filename, new_filename):
+            os.rename(
+                os.path.join(directory, filename), os.path.join(directory, new_filename)
+            )
+
+        yield rename
+
+
+def rename_batch(directory, renames):
+    """Rename files within a directory
+
+    Parameters
+    ---------------
+    directory : string
+        Path to directory
+    renames : iterable of (string, string)
+        (filename, new filename) pairs of files in directory, renamed in order
+
+    Notes
+    ---------------
+    The renames are issued through one directory_renamer.
+    """
+    with directory_renamer(directory) as rename:
+        for filename, new_filename in renames:
+            rename(filename, new_filename)
 
 
 def remove_extension(s):
@@ -151,12 +351,8 @@ def remove_extension(s):
     str
 
     """
-    if len(s.split(".")) > 1:
-        return "".join(
-            [x for i, x in enumerate(s.split(".")) if i < len(s.split(".")) - 1]
-        )
-    else:
-        return s
+    head, sep, _ = s.rpartition(".")
+    return head if sep else s
 
 
 # DATA MANIPULATION
@@ -206,6 +402,8 @@ def downsample_skip(n_skips=1, *args):
     Notes
     -------------------
     Requires the length of the objects in args to have same size along first dimension/axis
+    All objects are sliced, so e.g. NumPy arrays are returned as strided views
+    rather than copies.
 
     Examples
     ------------------------
@@ -213,18 +411,9 @@ def downsample_skip(n_skips=1, *args):
     out: a=[1,3], b=['a', 'c']
     """
     n_elements = len(args[0])
-    for i in range(len(args)):
-        assert len(args[i]) == n_elements
-    selected_elements_range = range(0, n_elements, n_skips)
-    selected_elements_slice = slice(0, n_elements, n_skips)
-    selected_data = tuple(
-        [
-            arg[selected_elements_slice]
-            if type(arg) == list
-            else arg[selected_elements_range]
-            for arg in args
-        ]
-    )
+    assert all(len(arg) == n_elements for arg in args)
+    selected_elements_slice = slice(None, None, n_skips)
+    selected_data = tuple(arg[selected_elements_slice] for arg in args)
     return selected_data
 
 
@@ -246,17 +435,128 @@ def get_selected_data(idx, *args):
     Notes
     --------------------
     This functions is kind of rendered pointless by zip
+    Arrays (objects with a dtype or an __array__ method, e.g. NumPy arrays and Torch
+    tensors) are indexed with idx as a list in a single call, and the selection is
+    returned as an array rather than a list.
     """
     n_elements = len(args[0])
-    for arg in args:
-        assert len(arg) == n_elements
-    selected_data = tuple([[arg[i] for i in idx] for arg in args])
+    assert all(len(arg) == n_elements for arg in args)
+
+    if len(idx) > 1:
+        getter = itemgetter(*idx)
+
+        def select(arg):
+            return list(getter(arg))
+
+    else:  # itemgetter returns a bare element for a single index
+
+        def select(arg):
+            return [arg[i] for i in idx]
+
+    idx_list = list(idx)  # A tuple would be taken as a multidimensional index
+
+    selected_data = tuple(
+        (
+            arg[idx_list]
+            if hasattr(arg, "dtype") or hasattr(arg, "__array__")
+            else select(arg)
+        )
+        for arg in args
+    )
     return selected_data
 
 
 # SAVING AND LOADING FILES
 #####################################################
 
+# Buffer size for pickle files, large enough to write typical files in a few syscalls
+_IO_BUFFER_SIZE = 1 << 20
+# Files at least this large are memory-mapped when loaded instead of read in chunks
+_MMAP_THRESHOLD = 1 << 20
+
+
+_NAME_ADJECTIVES = (
+    "blue",
+    "yellow",
+    "green",
+    "red",
+    "orange",
+    "pink",
+    "grey",
+    "white",
+    "black",
+    "turkouse",
+    "fushia",
+    "beige",
+    "purple",
+    "rustic",
+    "idyllic",
+    "kind",
+    "turbo",
+    "feverish",
+    "horrid",
+    "master",
+    "correct",
+    "insane",
+    "relevant",
+    "chocolate",
+    "silk",
+    "big",
+    "short",
+    "cool",
+    "mighty",
+    "weak",
+    "candid",
+    "figting",
+    "flustered",
+    "perplexed",
+    "screaming",
+    "hip",
+    "glorious",
+    "magnificent",
+    "crazy",
+    "gyrating",
+    "sleeping",
+)
+_NAME_NOUNS = (
+    "battery",
+    "horse",
+    "stapler",
+    "giraff",
+    "tiger",
+    "snake",
+    "cow",
+    "mouse",
+    "eagle",
+    "elephant",
+    "whale",
+    "shark",
+    "house",
+    "car",
+    "boat",
+    "bird",
+    "plane",
+    "sea",
+    "genius",
+    "leopard",
+    "clown",
+    "matador",
+    "bull",
+    "ant",
+    "starfish",
+    "falcon",
+    "eagle",
+    "warthog",
+    "fulcrum",
+    "tank",
+    "foxbat",
+    "flanker",
+    "fullback",
+    "archer",
+    "arrow",
+    "hound",
+)
+
 
 def generate_name():
     """Generates a unique, random and memorable file name
@@ -272,98 +572,18 @@ def generate_name():
     Written by Jan Pettersson
     """
     t = time.localtime()
-    a = random.choice(
-        [
-            "blue",
-            "yellow",
-            "green",
-            "red",
-            "orange",
-            "pink",
-            "grey",
-            "white",
-            "black",
-            "turkouse",
-            "fushia",
-            "beige",
-            "purple",
-            "rustic",
-            "idyllic",
-            "kind",
-            "turbo",
-            "feverish",
-            "horrid",
-            "master",
-            "correct",
-            "insane",
-            "relevant",
-            "chocolate",
-            "silk",
-            "big",
-            "short",
-            "cool",
-            "mighty",
-            "weak",
-            "candid",
-            "figting",
-            "flustered",
-            "perplexed",
-            "screaming",
-            "hip",
-            "glorious",
-            "magnificent",
-            "crazy",
-            "gyrating",
-            "sleeping",
-        ]
-    )
-    b = random.choice(
-        [
-            "battery",
-            "horse",
-            "stapler",
-            "giraff",
-            "tiger",
-            "snake",
-            "cow",
-            "mouse",
-            "eagle",
-            "elephant",
-            "whale",
-            "shark",
-            "house",
-            "car",
-            "boat",
-            "bird",
-            "plane",
-            "sea",
-            "genius",
-            "leopard",
-            "clown",
-            "matador",
-            "bull",
-            "ant",
-            "starfish",
-            "falcon",
-            "eagle",
-            "warthog",
-            "fulcrum",
-            "tank",
-            "foxbat",
-            "flanker",
-            "fullback",
-            "archer",
-            "arrow",
-            "hound",
-        ]
-    )
+    a = random.choice(_NAME_ADJECTIVES)
+    b = random.choice(_NAME_NOUNS)
 
-    datestr = time.strftime("%m%d%H%M%S", t).encode("utf8")
+    datestr = time.strftime("%m%d%H%M%S", t)
     b36 = base36encode(int(datestr))
     name = "{}_{}_{}".format(b36, a, b)
     return name.upper()
 
 
+_BASE36_CHARS = b"0123456789abcdefghijklmnopqrstuvwxyz"
+
+
 def base36encode(integer):
     """Base 36 encodes an integer
 
@@ -382,35 +602,84 @@ def base36encode(integer):
     Written by Jan Pettersson
 
     """
-    chars, encoded = "0123456789abcdefghijklmnopqrstuvwxyz", ""
-
+    digits = bytearray()
     while integer > 0:
         integer, remainder = divmod(integer, 36)
-        encoded = chars[remainder] + encoded
+        digits.append(_BASE36_CHARS[remainder])
+    digits.reverse()
 
-    return encoded
+    return digits.decode("ascii") or "0"
 
 
-def add_file_to_directory(
-    file, directory, write_method, extension, n_leading_zeros=None
-):
-    """Checks the number of existing files in 'directory' of format 'extension', and stores 'file' with the next filename in the sequence, assuming all files are named e.g. 00001.extension, 00002.extension, ...."""
-    existing_files = os.listdir(directory)
-    if n_leading_zeros is None:
-        n_leading_zeros = len(existing_files[0])
-    existing_indices = [
-        int(os.path.splitext(file)[0])
-        for file in existing_files
-        if file.endswith(extension)
-    ]
-    if len(existing_indices) > 0:
-        max_index = max(existing_indices)
-    else:
-        max_index = 0
-    file_path = os.path.join(
-        directory, str(max_index + 1).zfill(n_leading_zeros) + extension
-    )
-    write_method(file_path, file)
+# Index of the last file written by add_file_to_directory, per (directory, extension)
+_last_file_index = {}
+
+
+def add_file_to_directory(file, directory, write_method, extension, n_leading_zeros=5):
+    """Checks the number of existing files in 'directory' of format 'extension', and stores 'file' with the next filename in the sequence, assuming all files are named e.g. 00001.extension, 00002.extension, ....
+
+    Notes
+    --------------
+    The directory is only scanned on the first call for a (directory, extension) pair.
+    Subsequent calls continue the sequence from the last index written by this process.
+    Filenames are reserved with an exclusive create, so files added to the directory by
+    others in the meantime are skipped rather than overwritten.
+    """
+    key = (directory, extension)
+    last_index = _last_file_index.get(key)
+    if last_index is None:
+        with os.scandir(directory) as entries:
+            existing_indices = [
+                int(os.path.splitext(entry.name)[0])
+                for entry in entries
+                if entry.name.endswith(extension)
+            ]
+        last_index = max(existing_indices, default=0)
+
+    index = last_index + 1
+    while True:
+        file_path = os.path.join(
+            directory, str(index).zfill(n_leading_zeros) + extension
+        )
+        try:
+            os.close(os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666))
+            break
+        except FileExistsError:
+            index += 1
+    try:
+        write_method(file_path, file)
+    except BaseException:
+        # Release the reserved filename, so the index is used by the next call
+        os.unlink(file_path)
+        raise
+    _last_file_index[key] = index
+
+
+@lru_cache(maxsize=4096)
+def _ensure_dir(dirname):
+    """Create 'dirname' and its parents, at most once per process and directory
+
+    Notes
+    --------------
+    A directory removed after it was first ensured will not be recreated, use
+    _open_creating_dir to open files in directories which may have been removed.
+    """
+    os.makedirs(dirname, exist_ok=True)
+
+
+def _open_creating_dir(open_fn, path, *args, **kwargs):
+    """Open 'path' with 'open_fn', creating its parent directories if they don't exist"""
+    dirname = os.path.dirname(path)
+    if len(dirname) > 0:
+        _ensure_dir(dirname)
+    try:
+        return open_fn(path, *args, **kwargs)
+    except FileNotFoundError:
+        if len(dirname) == 0:
+            raise
+        # The directory was removed after it was first ensured
+        os.makedirs(dirname, exist_ok=True)
+        return open_fn(path, *args, **kwargs)
 
 
 def save_pickle(var, path):
@@ -421,17 +690,21 @@ def save_pickle(var, path):
     var
         Variable to save
     path : str
-        Target path to save the variable
+        Target path to save the variable. A path ending with '.gz' saves a gzip
+        compressed pickle.
 
     Notes
     --------------
     'path' does not need to point to path in an existing directory, directories will be created to adhere to 'path'
+    Compression uses the fastest level, which typically still shrinks e.g. model
+    checkpoints 2-3x.
     """
-    dirname = os.path.dirname(path)
-    if len(dirname) > 0:
-        os.makedirs(dirname, exist_ok=True)
-    with open(path, "wb") as file:
-        pickle.dump(var, file)
+    if str(path).endswith(".gz"):
+        file = _open_creating_dir(gzip.open, path, "wb", compresslevel=1)
+    else:
+        file = _open_creating_dir(open, path, "wb", buffering=_IO_BUFFER_SIZE)
+    with file:
+        pickle.dump(var, file, protocol=pickle.HIGHEST_PROTOCOL)
 
 
 def load_pickle(path):
@@ -440,14 +713,26 @@ def load_pickle(path):
     Parameters
     -------------------
     path : str
-        Path from which to load variable
+        Path from which to load variable. A path ending with '.gz' is read as a gzip
+        compressed pickle.
 
     Returns
     -----------------
     var
         Variable stored in pickle file at path
+
+    Notes
+    -----------------
+    Large uncompressed files are memory-mapped, letting the kernel page them in
+    instead of copying them through a read buffer.
     """
+    if str(path).endswith(".gz"):
+        with gzip.open(path, "rb") as file:
+            return pickle.load(file)
     with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size >= _MMAP_THRESHOLD:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return pickle.loads(mm)
         return pickle.load(file)
 
 
@@ -461,10 +746,7 @@ def save_txt(var, path):
     path : str
         Target path to write file
     """
-    dirname = os.path.dirname(path)
-    if len(dirname) > 0:
-        os.makedirs(dirname, exist_ok=True)
-    with open(path, "w") as file:
+    with _open_creating_dir(open, path, "w") as file:
         file.write(str(var))
 
 
@@ -516,7 +798,7 @@ class Ticker:
     def __init__(self, buffer_size=100, log_path=None):
         self.log_path = log_path
         self.__stopwatch = Stopwatch()
-        self.__buffer = RingBuffer(buffer_size)
+        self.__buffer = RingBuffer(buffer_size, dtype="d")
 
     def tick(self):
         """Make a tick (time between ticks are measured)
@@ -546,6 +828,17 @@ class Ticker:
         return self.__buffer.items()
 
 
+class _SourceState:
+    """Measurement state of a single MultiTicker source"""
+
+    __slots__ = ("stopwatch", "samples", "logfile")
+
+    def __init__(self, stopwatch, samples, logfile=None):
+        self.stopwatch = stopwatch
+        self.samples = samples
+        self.logfile = logfile
+
+
 # TODO: Warn user when measuring times too fast for this class to work properly with/without logging
 # TODO: Find more efficient implementation
 class MultiTicker:
@@ -565,33 +858,35 @@ class MultiTicker:
         )
 
     def tick(self, source, log_to_file=False):
-        if (
-            source in self.__sources
-        ):  # If we've already started measuring times for this event
-            elapsed = self.__sources[source]["stopwatch"].elapsed()
-            self.__sources[source]["stopwatch"].restart()
-            self.__sources[source]["samples"].put(elapsed)
-            if "logfile" in self.__sources[source]:
-                self.__sources[source]["logfile"].write(elapsed + "\n")
+        state = self.__sources.get(source)
+        if state is not None:  # If we've already started measuring times for this event
+            elapsed = state.stopwatch.restart()
+            state.samples.put(elapsed)
+            if state.logfile is not None:
+                state.logfile.write(str(elapsed) + "\n")
         else:  # Add source to dict of measured sources
             elapsed = 0
-            self.__sources[source] = {
-                "stopwatch": Stopwatch(),
-                "samples": RingBuffer(self.__buffer_size),
-            }
+            state = _SourceState(Stopwatch(), RingBuffer(self.__buffer_size, dtype="d"))
             if self.log_dir is not None and log_to_file:
-                self.__sources[source]["logfile"] = open(
-                    os.path.join(self.log_dir, source + ".txt"), "a"
-                )
-            self.__sources[source]["stopwatch"].start()
+                state.logfile = open(os.path.join(self.log_dir, source + ".txt"), "a")
+            self.__sources[source] = state
+            state.stopwatch.start()
         return elapsed
 
     def samples(self, source):
-        return self.__sources[source]["samples"].items()
+        return self.__sources[source].samples.items()
 
 
 class Stopwatch:
-    """Stopwatch class with similar functionality to Stopwatch in C#"""
+    """Stopwatch class with similar functionality to Stopwatch in C#
+
+    Notes
+    -------------
+    Time is measured in integer nanoseconds with the monotonic time.perf_counter_ns and
+    only converted to seconds when returned.
+    """
+
+    __slots__ = ("__is_running", "__elapsed", "__start_time", "__stop_time")
 
     def __init__(self):
         self.__is_running = False
@@ -620,15 +915,25 @@ class Stopwatch:
         ------------------------
         An interval is defined to be the time during which the stopwatch is running.
         """
+        return self.elapsed_ns() / 1e9
+
+    def elapsed_ns(self):
+        """Return the total elapsed time measured for an interval, in integer nanoseconds.
+
+        Returns
+        -----------------------
+        elapsed_ns : int
+            The total elapsed time measured for an interval
+        """
         if self.__is_running:
-            return self.__elapsed + time.time() - self.__start_time
+            return self.__elapsed + time.perf_counter_ns() - self.__start_time
         else:
             return self.__elapsed
 
     def start(self):
         """Starts measuring elapsed time for an interval."""
         if not self.__is_running:
-            self.__start_time = time.time()
+            self.__start_time = time.perf_counter_ns()
             self.__is_running = True
 
     def stop(self):
@@ -640,10 +945,10 @@ class Stopwatch:
             The total elapsed time measured for an interval
         """
         if self.__is_running:
-            self.__stop_time = time.time()
+            self.__stop_time = time.perf_counter_ns()
             self.__elapsed += self.__stop_time - self.__start_time
             self.__is_running = False
-        return self.__elapsed
+        return self.__elapsed / 1e9
 
     def reset(self):
         """Stops time interval measurement and resets the elapsed time to zero.
@@ -683,17 +988,24 @@ class Clocker:
 
     Above code snippet would store 100 samples of the execution time of fun1() and fun2() in files 'logdir/fun1.txt' and 'logdir/fun2.txt'.
     The sample time measured between clocks is the time it takes between subsequnt calls to clock() or the time between clock() and stop_clock()
+    The clock is read first thing when stopping and last thing when starting a measurement, so the bookkeeping in between is not part of any sample.
 
     Parameters
     -----------------------------
     logdir : str
         Path to directory in which to store time samples
+    flush_threshold : int or None
+        Number of samples of a target to collect in memory before writing them to its
+        log file in one go. Remaining samples are written by flush() and close(). If
+        None, samples are only written by flush() and close().
     """
 
-    def __init__(self, logdir, *targets):
+    def __init__(self, logdir, *targets, flush_threshold=64):
         os.makedirs(logdir, exist_ok=True)
         self.logdir = logdir
         self.target_logs = {}
+        self._pending = defaultdict(list)
+        self._flush_threshold = flush_threshold
         self._current_target = None
         self._t = None
         self.add_targets(*targets)
@@ -706,38 +1018,71 @@ class Clocker:
         target : str
             tag of process to measure time sample of
         """
+        t = time.perf_counter_ns()
         if self._t is not None:
-            self.stop_clock()
-        if target not in self.target_logs.keys():
+            self._record(t)
+        if target not in self.target_logs:
             self.add_targets(target)
-        self._start_clock(target)
+        self._current_target = target
+        self._t = time.perf_counter_ns()
 
     def stop_clock(self):
         """Stop current time measurement (if any)"""
-        t_elapsed = (time.time_ns() - self._t) / 1e9
-        self.target_logs[self._current_target].write(str(t_elapsed) + "\n")
-        self._current_target = None
+        t = time.perf_counter_ns()
+        if self._t is not None:
+            self._record(t)
 
     def add_targets(self, *targets):
-        """Open log files to append with time measurements"""
+        """Add targets to measure time samples of
+
+        Notes
+        ----------
+        A log file is only opened once the first samples of its target are written. It
+        is opened in append mode (O_APPEND) at the OS level, so that several processes
+        may log to the same file, and without buffering, since samples are already
+        batched in memory and each batch is written with a single write call.
+        """
         for target in targets:
-            self.target_logs[target] = open(
-                os.path.join(self.logdir, target + ".txt"), "a"
-            )
+            self.target_logs.setdefault(target, None)
 
     def flush(self):
-        """Flush all the current log files"""
-        for file in self.target_logs.values():
-            file.flush()
+        """Write all samples in memory to the log files"""
+        for target in self.target_logs:
+            self._write_pending(target)
 
     def close(self):
-        """Close all the current log files"""
-        for file in self.target_logs.values():
-            file.close()
-
-    def _start_clock(self, target):
-        self._current_target = target
-        self._t = time.time_ns()
+        """Write all samples in memory to the log files and close them"""
+        for target in self.target_logs:
+            self._write_pending(target)
+            fd = self.target_logs[target]
+            if fd is not None:
+                os.close(fd)
+                self.target_logs[target] = None
+
+    def _write_pending(self, target):
+        pending = self._pending[target]
+        if pending:
+            fd = self.target_logs[target]
+            if fd is None:
+                fd = self.target_logs[target] = _open_creating_dir(
+                    os.open,
+                    os.path.join(self.logdir, target + ".txt"),
+                    os.O_WRONLY | os.O_CREAT | os.O_APPEND,
+                    0o644,
+                )
+            data = memoryview("".join(f"{t / 1e9}\n" for t in pending).encode())
+            while data:
+                data = data[os.write(fd, data) :]
+            pending.clear()
+
+    def _record(self, t):
+        """Store the sample of the current measurement, which ended at time t"""
+        pending = self._pending[self._current_target]
+        pending.append(t - self._t)
+        if self._flush_threshold is not None and len(pending) >= self._flush_threshold:
+            self._write_pending(self._current_target)
+        self._current_target = None
+        self._t = None
 
     def __del__(self):
         self.close()
@@ -763,25 +1108,52 @@ class RingBuffer:
     ----------------
     buffer_size : int
         Number of elements to store in memory
+    dtype : str
+        (OPTIONAL) array.array type code, e.g. 'd' for floats. Items are then stored
+        as raw C values instead of Python objects. Leave at None to store arbitrary
+        objects. Either way, slots which have not been filled yet are returned as None.
+
+    Notes
+    ----------------
+    Items are stored twice, in two consecutive mirrored halves of the storage, so that
+    the n last items always form one contiguous slice regardless of wrap-around.
     """
 
-    def __init__(self, buffer_size=10):
-        self.__items = [None] * buffer_size
+    def __init__(self, buffer_size=10, dtype=None):
+        if dtype is None:
+            self.__items = [None] * (2 * buffer_size)
+        else:
+            self.__items = array.array(dtype, [0]) * (2 * buffer_size)
+        self.__dtype = dtype
         self.__buffer_size = buffer_size
         self.__index = 0
+        self.__full = False  # Until then, items have been put in slots [0, index)
 
     def items(self):
         """Get the items currently stored"""
-        return self.__items
+        items = self.__items[: self.__buffer_size]
+        if self.__dtype is None:
+            return items
+        items = items.tolist()
+        if not self.__full:
+            items[self.__index :] = [None] * (self.__buffer_size - self.__index)
+        return items
 
     def put(self, item):
         """Put a new item into the buffer, pushing out the longest existing tiem if full"""
-        self.__items[self.__index] = item
-        self.__index = (self.__index + 1) % self.__buffer_size
+        index = self.__index
+        self.__items[index] = self.__items[index + self.__buffer_size] = item
+        index += 1
+        if index == self.__buffer_size:
+            index = 0
+            self.__full = True
+        self.__index = index
 
     def last(self):
         """Get the last item put into the buffer"""
-        return self.__items[(self.__index - 1) % self.__buffer_size]
+        if self.__index == 0 and not self.__full:
+            return None
+        return self.__items[self.__index - 1]
 
     def n_last(self, n):
         """Get the n last items put into the buffer
@@ -792,11 +1164,14 @@ class RingBuffer:
             List of n last items
         """
         assert n <= self.__buffer_size
-        latest_items = []
-        for i in reversed(range(n)):
-            latest_items.append(
-                self.__items[(self.__index - i - 1) % self.__buffer_size]
-            )
+        end = self.__index + self.__buffer_size
+        latest_items = self.__items[end - n : end]
+        if self.__dtype is None:
+            return latest_items
+        latest_items = latest_items.tolist()
+        n_empty = n - self.__index
+        if not self.__full and n_empty > 0:
+            latest_items[:n_empty] = [None] * n_empty
         return latest_items
 
 
@@ -824,16 +1199,12 @@ def list_options(options: List[str], *additional_attributes: List[str]) -> None:
          2: elephant mammal       `
     """
 
-    def space_fill(strings: List[str]) -> List[str]:
-        max_len = max(len(s) for s in strings)
-        return [s + " " * (max_len - len(s)) for s in strings]
-
-    indices = space_fill([f"{i+1}:" for i in range(len(options))])
-    options = space_fill(options)
-    attributes = [space_fill(a) for a in additional_attributes]
+    indices = [f"{i+1}:" for i in range(len(options))]
+    columns = (indices, options, *additional_attributes)
+    widths = [max(map(len, column)) for column in columns]
 
-    for option in zip(indices, options, *attributes):
-        print(" ".join(option))
+    for row in zip(*columns):
+        print(" ".join(f"{s:<{w}}" for s, w in zip(row, widths)))
 
 
 def select_options(
@@ -931,21 +1302,63 @@ REPO_ROOT = Path(__file__).parents[1]
 CACHE_DIR = REPO_ROOT / ".cache"
 
 
+# Cache keys don't need a cryptographic hash. Use the much faster xxhash if it happens
+# to be installed, but don't depend on it.
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+if xxhash is not None:
+    _new_hasher = xxhash.xxh3_64
+else:
+    _new_hasher = partial(hashlib.blake2b, digest_size=16)
+
+
+def _hash_field(hasher, tag, data):
+    """Feed one tagged, length prefixed field to 'hasher', so fields can't run into each other"""
+    hasher.update(tag)
+    hasher.update(len(data).to_bytes(8, "little"))
+    hasher.update(data)
+
+
+def _hash_value(hasher, value):
+    if isinstance(value, (bytes, bytearray)):
+        _hash_field(hasher, b"b", value)
+    else:
+        _hash_field(hasher, b"s", str(value).encode())
+
+
 def simple_hash_fun(*args, **kwargs) -> str:
     """
     Assumes that all arguments can be cast to a string.
+
+    Arguments are fed to the hasher one at a time instead of being joined into one large
+    string first. Bytes are hashed as is. Keyword arguments are hashed in sorted order,
+    so the hash doesn't depend on the order they were passed in.
+
+    Every argument is tagged with its kind (bytes or string, and the keyword name for
+    keyword arguments) and prefixed with its length, so e.g. b"abc" and "abc", "a=1"
+    and a=1, or "a§b" and ("a", "b") hash differently.
     """
-    return hashlib.sha1(
-        ("§".join((str(arg) for arg in args)) + str(kwargs)).encode()
-    ).hexdigest()
+    hasher = _new_hasher()
+    for arg in args:
+        _hash_value(hasher, arg)
+    for key, value in sorted(kwargs.items()):
+        _hash_field(hasher, b"k", key.encode())
+        _hash_value(hasher, value)
+    return hasher.hexdigest()
 
 
 def cache(
     hash_fun: Callable[..., str] = simple_hash_fun,
     cache_dir: Path = CACHE_DIR,
     cache_id: str = None,
-    dump_fn: Callable[[Any, BinaryIO], None] = pickle.dump,
+    dump_fn: Callable[[Any, BinaryIO], None] = partial(
+        pickle.dump, protocol=pickle.HIGHEST_PROTOCOL
+    ),
     load_fn: Callable[[BinaryIO], Any] = pickle.load,
+    memory_size: int = 0,
 ):
     """
     Decorator which caches output of a function based on hashable function inputs.
@@ -957,24 +1370,55 @@ def cache(
     cached with the hash as a key.
 
     User must supply a function which produces a hash from the values of the input.
+
+    Optionally, the `memory_size` most recently used outputs are also kept in memory, so
+    repeated calls within the same process skip the file system entirely. Note that those
+    calls return the same object, not a fresh copy, so mutating an output changes later
+    results, and that the outputs are kept alive. Disabled by default (`memory_size`=0).
     """
 
     def _decorator(fun):
+        cache_id_ = cache_id if cache_id else fun.__name__
+        memory = OrderedDict()
+
         def wrapper(*args, **kwargs):
-            cache_id_ = cache_id if cache_id else fun.__name__
             hash = hash_fun(*args, **kwargs)
-            cache_fp = cache_dir / cache_id_ / f"{hash}.cache"
-
-            if cache_fp.is_file():
-                with open(cache_fp, "rb") as f:
-                    return load_fn(f)
+            if hash in memory:
+                memory.move_to_end(hash)
+                return memory[hash]
 
-            output = fun(*args, **kwargs)
-
-            cache_fp.parent.mkdir(parents=True, exist_ok=True)
-            with open(cache_fp, "wb") as f:
-                dump_fn(output, f)
+            cache_fp = cache_dir / cache_id_ / f"{hash}.cache"
+            try:
+                f = open(cache_fp, "rb")
+            except FileNotFoundError:
+                f = None
+
+            if f is not None:
+                with f:
+                    output = load_fn(f)
+            else:
+                output = fun(*args, **kwargs)
 
+                # Dump to a temporary file and move it into place, so an interrupted
+                # dump never leaves a truncated cache file behind.
+                tmp_fp = cache_fp.with_name(
+                    f".{hash}.{os.getpid()}.{threading.get_ident()}.tmp"
+                )
+                try:
+                    with _open_creating_dir(
+                        open, tmp_fp, "wb", buffering=_IO_BUFFER_SIZE
+                    ) as f:
+                        dump_fn(output, f)
+                    os.replace(tmp_fp, cache_fp)
+                except BaseException:
+                    if tmp_fp.exists():
+                        tmp_fp.unlink()
+                    raise
+
+            if memory_size > 0:
+                memory[hash] = output
+                if len(memory) > memory_size:
+                    memory.popitem(last=False)
             return output
 
         return wrapper
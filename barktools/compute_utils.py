@@ -1,3 +1,5 @@
+import operator
+
 import numpy as np
 import pandas as pd
 
@@ -22,12 +24,14 @@ class MultiBaseNumber:
             self.bases = bases
         else:
             raise ArithmeticError("Provided bases are not eligible")
+        self.__weights = self.__compute_weights(bases)
+        self.__weights_array = None
 
         if digits is None:
             self.digits = [0] * len(self.bases)
         else:
             if self.__check_digits(digits):
-                self.digits = digits
+                self.digits = list(digits)  # Incremented in place
             else:
                 raise ArithmeticError(
                     "Provided digits not compatible with specified bases"
@@ -36,6 +40,16 @@ class MultiBaseNumber:
     def __check_bases(self, bases):
         return all([base > 0 for base in bases])
 
+    def __compute_weights(self, bases):
+        """Compute the place value of each digit, i.e. the product of all bases to its right
+
+        Returns : list of int
+        """
+        weights = [1] * len(bases)
+        for i in reversed(range(len(bases) - 1)):
+            weights[i] = weights[i + 1] * bases[i + 1]
+        return weights
+
     def __check_digits(self, digits):
         """Checks if 'digits' is compatible with 'bases'
 
@@ -51,34 +65,103 @@ class MultiBaseNumber:
             return False
         return all([digits[i] < self.bases[i] for i in range(len(digits))])
 
+    def __comparable(self, other):
+        """Return comparable representations of self and other
+
+        Numbers with identical bases are ordered like their digits (leftmost digit is
+        most significant), so they are compared digit by digit without computing
+        base_10().
+        """
+        if self.bases is other.bases or tuple(self.bases) == tuple(other.bases):
+            return tuple(self.digits), tuple(other.digits)
+        return self.base_10(), other.base_10()
+
     def __eq__(self, other):
-        return self.base_10() == other.base_10()
+        a, b = self.__comparable(other)
+        return a == b
 
     def __ne__(self, other):
-        return self.base_10() != other.base_10()
+        a, b = self.__comparable(other)
+        return a != b
 
     def __lt__(self, other):
-        return self.base_10() < other.base_10()
+        a, b = self.__comparable(other)
+        return a < b
 
     def __gt__(self, other):
-        return self.base_10() > other.base_10()
+        a, b = self.__comparable(other)
+        return a > b
 
     def __le__(self, other):
-        return self.base_10() <= other.base_10()
+        a, b = self.__comparable(other)
+        return a <= b
 
     def __ge__(self, other):
-        return self.base_10() >= other.base_10()
+        a, b = self.__comparable(other)
+        return a >= b
+
+    def increment(self):
+        """Increment the number by one in place
+
+        Only the trailing digits which are at their maximum and the digit to their left
+        are touched, i.e. O(1) digits on average when enumerating numbers.
+
+        Returns : bool
+            False if the number overflowed and wrapped around to zero, True otherwise
+        """
+        digits, bases = self.digits, self.bases
+        i = len(digits) - 1
+        while i >= 0 and digits[i] == bases[i] - 1:
+            digits[i] = 0
+            i -= 1
+        if i < 0:
+            return False
+        digits[i] += 1
+        return True
+
+    def __iter__(self):
+        """Iterate over this number and all larger numbers with the same bases
+
+        The number is incremented in place and the same instance is yielded every time,
+        so copy e.g. its digits to keep a value. The number wraps around to zero when
+        the iteration is exhausted.
+        """
+        yield self
+        while self.increment():
+            yield self
 
     def base_10(self):
         """Return the base 10 value of the MultiBaseNumber
 
         Returns : int
+
+        Notes
+        ---------------
+        The value is the sum of the digits multiplied with precomputed place values.
+        """
+        return sum(map(operator.mul, self.__weights, self.digits))
+
+    def base_10_batch(self, digits):
+        """Return the base 10 values of many digit sequences with the bases of this number
+
+        Parameters
+        ---------------
+        digits : array_like
+            Digits of the numbers, shape=[n_numbers, len(bases)]
+            digits[:, 0] are the leftmost digits
+
+        Returns : np.ndarray
+            Base 10 values, shape=[n_numbers]. Values are Python ints (object dtype) if
+            the largest number representable with the bases does not fit in an int64.
         """
-        n, b = 0, 1
-        for i in reversed(range(len(self.digits))):
-            n = n + b * self.digits[i]
-            b = b * self.bases[i]
-        return n
+        if self.__weights_array is None:
+            n_numbers = self.__weights[0] * self.bases[0] if len(self.bases) > 0 else 1
+            fits_int64 = n_numbers - 1 <= np.iinfo(np.int64).max
+            self.__weights_array = np.array(
+                self.__weights, dtype=np.int64 if fits_int64 else object
+            )
+        weights = self.__weights_array
+        return np.asarray(digits, dtype=weights.dtype) @ weights
 
 
 class MinusInf:
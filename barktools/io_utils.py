@@ -2,6 +2,55 @@ import pickle
 import base64
 import pyperclip
 
+# Marks payloads framed by _pack, older payloads are plain pickles
+_PACK_HEADER = b'BT1'
+
+def _pack(obj):
+    """
+    Pickle an object with protocol 5, keeping large binary buffers (e.g. numpy
+    arrays) out-of-band instead of copying them into the pickle stream.
+
+    The pickle stream and each out-of-band buffer are framed with an 8 byte
+    little-endian length prefix and concatenated after a short header.
+
+    Parameters:
+    - obj: The object to be pickled.
+
+    Returns:
+    The framed bytes.
+    """
+    buffers = []
+    data = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+    frames = [_PACK_HEADER, len(data).to_bytes(8, 'little'), data]
+    for buffer in buffers:
+        raw = buffer.raw()
+        frames += [raw.nbytes.to_bytes(8, 'little'), raw]
+    return b''.join(frames)
+
+def _unpack(packed):
+    """
+    Unpickle an object from bytes produced by _pack. Bytes without the _pack
+    header are unpickled as a plain pickle, as written by earlier versions.
+
+    Parameters:
+    - packed: The framed bytes.
+
+    Returns:
+    The unpickled object.
+    """
+    if not packed.startswith(_PACK_HEADER):
+        return pickle.loads(packed)
+    # Copy once into a bytearray so that out-of-band buffers come back writable
+    view = memoryview(bytearray(packed))
+    frames = []
+    offset = len(_PACK_HEADER)
+    while offset < len(view):
+        size = int.from_bytes(view[offset:offset + 8], 'little')
+        offset += 8
+        frames.append(view[offset:offset + size])
+        offset += size
+    return pickle.loads(frames[0], buffers=frames[1:])
+
 def serialize_to_clipboard(obj):
     """
     Serialize an arbitrary object using pickle, encode the bytes to base64,
@@ -14,8 +63,10 @@ def serialize_to_clipboard(obj):
     None
     """
     try:
-        serialized_data = pickle.dumps(obj)
-        encoded_data = base64.b64encode(serialized_data).decode('utf-8')
+        serialized_data = _pack(obj)
+        # base64 rather than the denser base85: CPython implements b85 in pure
+        # Python, which makes it roughly 80x slower on large payloads.
+        encoded_data = base64.b64encode(serialized_data).decode('ascii')
         pyperclip.copy(encoded_data)
         print("Object serialized and copied to clipboard.")
     except Exception as e:
@@ -32,8 +83,8 @@ def deserialize_from_clipboard():
     try:
         clipboard_data = pyperclip.paste()
         if clipboard_data:
-            decoded_data = base64.b64decode(clipboard_data.encode('utf-8'))
-            obj = pickle.loads(decoded_data)
+            decoded_data = base64.b64decode(clipboard_data)
+            obj = _unpack(decoded_data)
             print("Object de-serialized successfully.")
             return obj
         else:
@@ -1,7 +1,5 @@
 # Functions here may depend on the matplotlib package
-import itertools
 import math
-import random
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -9,15 +7,50 @@ from matplotlib import colors as mcolors
 
 # Variables
 ##########################################
-plt_colors_base = list(dict(mcolors.BASE_COLORS).keys())
-plt_colors_css4 = list(dict(mcolors.CSS4_COLORS).keys())
+plt_colors_base = tuple(mcolors.BASE_COLORS)
+plt_colors_css4 = tuple(mcolors.CSS4_COLORS)
+
+
+# Classes
+##########################################
+
+
+class ColorCycler:
+    """Endless iterator over a sequence of colors which also supports random access
+
+    Parameters
+    --------------
+    colors : sequence
+        Colors to cycle through
+
+    Notes
+    --------------
+    cycler[i] is colors[i % len(colors)], independent of how many colors next() has returned.
+    """
+
+    def __init__(self, colors):
+        self.colors = tuple(colors)
+        self._index = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        color = self.colors[self._index]
+        self._index = (self._index + 1) % len(self.colors)
+        return color
+
+    def __getitem__(self, i):
+        return self.colors[i % len(self.colors)]
+
+    def __len__(self):
+        return len(self.colors)
 
 
 # Functions
 ##########################################
 
 
-# TODO: Better solution for seeding. Currently, seeding would affect all randomizations for the rest of the functions in this module, right?
 def color_cycler_plt(colormap="base", order=None, n_colors=None, seed=None):
     """Returns an iterator for matplotlib colors
 
@@ -32,12 +65,12 @@ def color_cycler_plt(colormap="base", order=None, n_colors=None, seed=None):
     n_colors : int
         Same as above, just leave it at None
     seed : int
-        I guess?
+        Seed for the random order, passed to numpy.random.default_rng. Only affects this call, the global random state is left untouched.
 
     Returns
     ------------
-    plt_color_cycler : iterator
-        Iterator for matplotlib colors
+    plt_color_cycler : ColorCycler
+        Endless iterator for matplotlib colors, which can also be indexed
 
     """
 
@@ -49,20 +82,16 @@ def color_cycler_plt(colormap="base", order=None, n_colors=None, seed=None):
         print("plt_color_cycler: Please specify a valid colormap. Using base for now.")
         plt_colors = plt_colors_base
 
-    if seed is not None:
-        random.seed(seed)
-
     if order is not None:
         if order == "random":
-            order = list(range(len(plt_colors)))
-            random.shuffle(order)
-            if n_colors is not None:
-                order = [order[i] for i in range(n_colors)]  # Shrink the list
-
-        assert isinstance(order, list)
-        plt_colors = [plt_colors[i] for i in order]
+            rng = np.random.default_rng(seed)
+            order = rng.permutation(len(plt_colors))[: n_colors or len(plt_colors)]
+            plt_colors = [plt_colors[i] for i in order]
+        else:
+            assert isinstance(order, list)
+            plt_colors = [plt_colors[i] for i in order]
 
-    plt_color_cycler = itertools.cycle(plt_colors)
+    plt_color_cycler = ColorCycler(plt_colors)
 
     return plt_color_cycler
 
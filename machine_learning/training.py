@@ -1,6 +1,11 @@
 # GUIDELINE SCRIPT FOR TRAINING A MODEL
 #################################################
 
+import os
+import json
+
+import numpy as np
+
 # Torch
 import torch
 
@@ -16,13 +21,15 @@ import CustomDataset # Torch dataset
 learning_rate = 1e-4
 
 batch_size = 8
+n_workers = 4 # Number of data loading worker processes
 n_epochs = 100
 min_delta_factor = 0.05 # Only count network as significant improvement (for early stopping) if the loss is this many percent less than previous best 
 patience = 10 # Number of epochs without significant improvment before early stopping
 
 training_data_dir = './data/train'
 validation_data_dir = './data/validation'
-checkpoint_path = './checkpoints'
+checkpoint_dir = './checkpoints'
+resume_training = False # Resume from the checkpoint in checkpoint_dir
 
 
 
@@ -30,49 +37,94 @@ checkpoint_path = './checkpoints'
 # TRAINING AND VALIDATION FUNCTION DEFINITIONS
 ###############################################
 
-# Completes one epoch of training of 'model' to fit data from 'data_loader' using 'optimizer'
-def train(model, data_loader, optimizer):
+# Iterates over batches from 'data_loader' on the GPU, copying the next batch on a side stream while the current one is processed
+# (the data loader should use pinned memory for the copies to be asynchronous)
+class CUDAPrefetcher:
+
+	def __init__(self, data_loader):
+		self.data_loader = data_loader
+		self.copy_stream = torch.cuda.Stream()
+
+	def __len__(self):
+		return len(self.data_loader)
+
+	def __iter__(self):
+		batches = iter(self.data_loader)
+		next_data = self._preload(batches)
+		while next_data is not None:
+			# Wait for the copy of this batch before using it, then start copying the next one
+			torch.cuda.current_stream().wait_stream(self.copy_stream)
+			data = next_data
+			for d in data:
+				d.record_stream(torch.cuda.current_stream())
+			next_data = self._preload(batches)
+			yield data
+
+	def _preload(self, batches):
+		try:
+			data = next(batches)
+		except StopIteration:
+			return None
+		with torch.cuda.stream(self.copy_stream):
+			return [d.cuda(non_blocking=True) for d in data]
+
+# Completes one epoch of mixed precision training of 'model' to fit data from 'data_loader' using 'optimizer' and gradient scaler 'scaler'
+# Returns the mean batch loss of the epoch as a float (the only point at which the CPU waits for the GPU)
+def train(model, data_loader, optimizer, scaler):
 
 	if not model.training:
 		model.train()
 
+	loss_sum = 0.0
+	n_batches = 0
+
 	# Iterate over batches
-	for idx, data in enumerate(data_loader):
+	for idx, data in enumerate(CUDAPrefetcher(data_loader)):
 		
 		# Extract data
-		inputs, outputs_gt = [d.cuda() for d in data]
-
-		# Forward propagate
-		outputs_pred = model(inputs)
+		inputs, outputs_gt = data
 
-		# Compute loss
-		loss = custom_loss(outputs_pred, outputs_gt)
+		# Forward propagate and compute loss
+		with torch.amp.autocast('cuda'):
+			outputs_pred = model(inputs)
+			loss = custom_loss(outputs_pred, outputs_gt)
 
 		# Update weights w.r.t. loss
 		optimizer.zero_grad()
-		loss.backward()
-		optimizer.step()
+		scaler.scale(loss).backward()
+		scaler.step(optimizer)
+		scaler.update()
 
-	return loss
+		# Detach so that the graph of the batch is not kept alive, and sum on the GPU (in float32) to avoid a sync per batch
+		loss_sum += loss.detach().float()
+		n_batches += 1
 
-# Computes loss of 'model' on validation data from 'data_loader'
+	return float(loss_sum) / n_batches
+
+# Computes the mean batch loss of 'model' on validation data from 'data_loader'
 def validate(model, data_loader):
 
 	if model.training:
 		model.eval()
 
-	# Iterate over batches
-	for idx, data in enumerate(data_loader):
-		with torch.no_grad():
+	loss_sum = 0.0
+	n_batches = 0
+
+	with torch.no_grad(), torch.amp.autocast('cuda'):
+
+		# Iterate over batches
+		for idx, data in enumerate(CUDAPrefetcher(data_loader)):
 
 			# Extract data and forward propagate
-			inputs, outputs_gt = [d.cuda() for d in data]
+			inputs, outputs_gt = data
 			outputs_pred = model(inputs)
 
 			# Compute loss
 			loss = custom_loss(outputs_pred, outputs_gt)
+			loss_sum += loss.float()
+			n_batches += 1
 
-	return loss
+	return float(loss_sum) / n_batches
 
 
 
@@ -89,37 +141,54 @@ def main():
 	# Initialize the optimizer
 	optimizer = torch.optim.Adam(model.parameters(), lr=learning_rate) # e.g. Adam from torch
 
+	# Initialize the gradient scaler for mixed precision training
+	scaler = torch.amp.GradScaler('cuda')
+
+	# Worker processes are kept alive between epochs and each prefetch two batches ahead (neither is allowed without workers, e.g. n_workers = 0 when debugging)
+	worker_kwargs = dict(persistent_workers=True, prefetch_factor=2) if n_workers > 0 else {}
+
 	# Create the training dataloader
 	training_set = CustomDataset(data_dir=training_data_dir)
 	training_sampler = torch.utils.data.RandomSampler(training_set)
 	training_sampler = torch.utils.data.BatchSampler(training_sampler, batch_size)
-	training_loader = torch.utils.data.DataLoader(training_set, batch_sampler=training_sampler)
+	training_loader = torch.utils.data.DataLoader(training_set, batch_sampler=training_sampler, pin_memory=True, num_workers=n_workers, **worker_kwargs)
 
 	# Create the validation dataloader
 	validation_set = CustomDataset(data_dir=validation_data_dir)
 	validation_sampler = torch.utils.data.RandomSampler(validation_set)
 	validation_sampler = torch.utils.data.BatchSampler(validation_sampler, batch_size)
-	validation_loader = torch.utils.data.DataLoader(validation_set, batch_sampler=validation_sampler)
+	validation_loader = torch.utils.data.DataLoader(validation_set, batch_sampler=validation_sampler, pin_memory=True, num_workers=n_workers, **worker_kwargs)
 
 
 
-	# Initialize training state
+	# The checkpoint is split into the tensor state (torch.save) and the plain training metadata (JSON)
+	weights_path = os.path.join(checkpoint_dir, 'weights.pt')
+	meta_path = os.path.join(checkpoint_dir, 'meta.json')
+
+	# Initialize training state (the loss histories hold one loss per epoch, NaN for epochs not yet run)
+	loss_training_history = np.full(n_epochs, np.nan, dtype=np.float32)
+	loss_validation_history = np.full_like(loss_training_history, np.nan)
 	if resume_training:
-		print('Attempting to resume training from checkpoint at ' + checkpoint_path)
-		if os.path.isfile(checkpoint_path):
-			checkpoint = torch.load(checkpoint_path)
-			model.load_state_dict(checkpoint['model'])
-			optimizer.load_state_dict(checkpoint['optimizer'])
-			loss_training_history, loss_validation_history = checkpoint['loss']
-			starting_epoch = checkpoint['epoch_finished'] + 1
-			loss_validation_best = checkpoint['loss_validation_best']
-			loss_validation_improvement = checkpoint['loss_validation_improvement']
-			n_epochs_since_improvement = checkpoint['n_epochs_since_improvement']
+		print('Attempting to resume training from checkpoint at ' + checkpoint_dir)
+		if os.path.isfile(weights_path) and os.path.isfile(meta_path):
+			weights = torch.load(weights_path)
+			model.load_state_dict(weights['model'])
+			optimizer.load_state_dict(weights['optimizer'])
+			scaler.load_state_dict(weights['scaler'])
+			with open(meta_path, 'r') as file:
+				meta = json.load(file)
+			if weights['epoch_finished'] != meta['epoch_finished']:
+				print('Checkpoint weights (epoch {}) and metadata (epoch {}) do not match. Exiting.'.format(weights['epoch_finished'], meta['epoch_finished']))
+				exit()
+			starting_epoch = meta['epoch_finished'] + 1
+			loss_training_history[:starting_epoch], loss_validation_history[:starting_epoch] = meta['loss']
+			loss_validation_best = meta['loss_validation_best']
+			loss_validation_improvement = meta['loss_validation_improvement']
+			n_epochs_since_improvement = meta['n_epochs_since_improvement']
 		else:
-			print('No checkpoint found at ' + checkpoint_path + '. Exiting.')
+			print('No checkpoint found at ' + checkpoint_dir + '. Exiting.')
 			exit()
 	else:
-		loss_training_history, loss_validation_history = ([],[])
 		starting_epoch = 0
 		loss_validation_best = 1.7976931348623157e+30
 		loss_validation_improvement = loss_validation_best
@@ -131,24 +200,32 @@ def main():
 	for iEpoch in range(starting_epoch, n_epochs):
 
 		# Train the model
-		loss_training = train(model, training_loader, optimizer)
-		loss_training_history.append(loss_training)
+		loss_training = train(model, training_loader, optimizer, scaler)
+		loss_training_history[iEpoch] = loss_training
 
 		# Validate the model
 		loss_validation = validate(model, validation_loader)
-		loss_validation_history.append()
+		loss_validation_history[iEpoch] = loss_validation
 
-		# Save the checkpoint
-		checkpoint = {
+		# Save the checkpoint (each file is written to a temporary file which then replaces the old one, metadata last)
+		weights = {
 			'epoch_finished': iEpoch,
 			'model': model.state_dict(),
 			'optimizer': optimizer.state_dict(),
-			'loss': (loss_training_history, loss_validation_history),
+			'scaler': scaler.state_dict()
+			}
+		torch.save(weights, weights_path + '.tmp')
+		os.replace(weights_path + '.tmp', weights_path)
+		meta = {
+			'epoch_finished': iEpoch,
+			'loss': (loss_training_history[:iEpoch+1].tolist(), loss_validation_history[:iEpoch+1].tolist()),
 			'loss_validation_best': loss_validation_best,
 			'loss_validation_improvement': loss_validation_improvement,
 			'n_epochs_since_improvement': n_epochs_since_improvement
 			}
-		torch.save(checkpoint, os.path.join(checkpoint_dir, 'checkpoint.pt'))
+		with open(meta_path + '.tmp', 'w') as file:
+			json.dump(meta, file)
+		os.replace(meta_path + '.tmp', meta_path)
 
 		# Save the best model (TODO: Bake the datetime into filename)
 		if loss_validation < loss_validation_best:
@@ -3,22 +3,95 @@
 import os 
 import sys
 import argparse
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
-from barktools.base_utils import find_nbr_of_files
+from barktools.base_utils import directory_renamer
 
 # Parse arguments
 
-def index_files(target_dir, extension, n_leading_zeros=6):
-	i = 0 
-	n_files = find_nbr_of_files(target_dir, extension)
-	for filename in os.listdir(target_dir): 
-		if filename.endswith(extension):
-		    dst = str(i).zfill(n_leading_zeros) + '.' +  extension
-		    src = os.path.join(target_dir, filename) 
-		    dst = os.path.join(target_dir, dst)
-		    os.rename(src, dst) 
-		    i += 1
-		    sys.stdout.write("\rProcessed {}/{} files.".format(i, n_files))
+# Sort key placing numerically named files first, in order of their number, followed by the rest in name order
+def index_order(filename):
+	try:
+		return (0, int(filename.split('.')[0]), filename)
+	except ValueError:
+		return (1, 0, filename)
+
+# Renames files left under temporary names back to their original names, where those are still free
+# Returns the (temporary name, original name) pairs of files which could not be restored
+def restore_temporary_names(target_dir, srcs, tmps):
+	not_restored = []
+	for src, tmp in zip(srcs, tmps):
+		tmp_path = os.path.join(target_dir, tmp)
+		if not os.path.lexists(tmp_path):
+			continue
+		src_path = os.path.join(target_dir, src)
+		try:
+			if os.path.lexists(src_path):
+				raise FileExistsError(src_path)
+			os.rename(tmp_path, src_path)
+		except OSError:
+			not_restored.append((tmp, src))
+	return not_restored
+
+def index_files(target_dir, extension, n_leading_zeros=6, n_workers=1):
+	# The extension may be given with or without its dot, but may not reach outside of the directory
+	extension = extension.lstrip('.')
+	if not extension or any(sep in extension for sep in (os.sep, os.altsep) if sep):
+		raise ValueError('Invalid extension: {}'.format(extension))
+
+	# Match the full '.extension' suffix, so that e.g. 'jpg' does not match 'foo_jpg'
+	dot_ext = '.' + extension
+	with os.scandir(target_dir) as entries:
+		filenames = sorted((entry.name for entry in entries if entry.name.endswith(dot_ext) and entry.is_file()), key=index_order)
+
+	# Plan all renames up front, leaving out files which already have their target name
+	dot_ext_pattern = dot_ext.replace('{', '{{').replace('}', '}}') # Escaped for use in format patterns
+	dst_name = ('{{:0{}d}}'.format(n_leading_zeros) + dot_ext_pattern).format
+	renames = []
+	for i, filename in enumerate(filenames):
+		dst = dst_name(i)
+		if filename != dst:
+			renames.append((filename, dst))
+	srcs = [src for src, _ in renames]
+	dsts = [dst for _, dst in renames]
+
+	# If a target name is also a file still to be renamed, renaming directly could clobber it. The files are then first
+	# moved to unique temporary names, after which all target names are free and the renames can run in any order
+	if set(srcs).isdisjoint(dsts):
+		passes = [(srcs, dsts)]
+	else:
+		tmp_name = ('.__idx_{}_{{}}'.format(uuid.uuid4().hex) + dot_ext_pattern).format
+		tmps = [tmp_name(i) for i in range(len(renames))]
+		passes = [(srcs, tmps), (tmps, dsts)]
+	n_files = len(renames)
+	parallel = n_workers > 1
+
+	# Issue the renames back to back, relative to the opened directory where the platform allows it (see directory_renamer)
+	with directory_renamer(target_dir) as rename:
+		executor = ThreadPoolExecutor(max_workers=n_workers) if parallel else None
+		try:
+			for n_pass, (pass_srcs, pass_dsts) in enumerate(passes, 1):
+				final_pass = n_pass == len(passes)
+				for i, _ in enumerate((executor.map if parallel else map)(rename, pass_srcs, pass_dsts), 1):
+				    if final_pass and (i & 0x3FF == 0 or i == n_files): # Report progress every 1024 files and when done
+				        sys.stdout.write("\rRenamed {}/{} files.".format(i, n_files))
+				        sys.stdout.flush()
+		except BaseException:
+			if len(passes) > 1:
+				if executor is not None:
+					executor.shutdown() # Let renames already in flight finish before restoring
+				not_restored = restore_temporary_names(target_dir, srcs, tmps)
+				print('\nRenaming failed. Files not yet renamed were restored to their original names.', file=sys.stderr)
+				if not_restored:
+					print('Files left under temporary names, as their original names are taken:', file=sys.stderr)
+					for tmp, src in not_restored:
+						print('  {} (originally {})'.format(tmp, src), file=sys.stderr)
+			raise
+		finally:
+			# Before the directory is closed, as renames may still be in flight
+			if executor is not None:
+				executor.shutdown()
 	print()
 
 def main():
@@ -26,12 +99,14 @@ def main():
 	parser.add_argument('--directory', '-d', help='Directory in which to rename files')
 	parser.add_argument('--leading_zeros', '-n', help='Number of leading zeros in filename', default=6)
 	parser.add_argument('--extension', '-e', help='Extension of file')
+	parser.add_argument('--workers', '-w', help='Number of threads renaming files concurrently', default=1)
 	args = parser.parse_args()
 	target_dir = args.directory
 	n_leading_zeros = int(args.leading_zeros)
 	extension = args.extension
+	n_workers = int(args.workers)
 
-	index_files(target_dir, extension, n_leading_zeros)
+	index_files(target_dir, extension, n_leading_zeros, n_workers)
 
 if __name__ == '__main__':
 	main()
\ No newline at end of file
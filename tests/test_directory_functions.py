@@ -1,7 +1,20 @@
 import os
+import pickle
+import shutil
+import stat
+import time
 from os.path import join
+from pathlib import Path
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
-from barktools.base_utils import find_nbr_of_files, list_files, list_files_recursive
+import numpy as np
+import pytest
+
+from barktools.base_utils import find_nbr_of_files, list_files, list_files_recursive, iter_files_recursive, change_num_format, add_file_to_directory, save_txt, load_txt, save_pickle, load_pickle, Clocker, cache
+from barktools.base_utils import _MMAP_THRESHOLD
+from barktools import base_utils
+from scripts.index_files import index_files
 
 from tests.test_helper import EXAMPLE_DIR
 
@@ -11,6 +24,35 @@ def test_find_nbr_of_files():
     n_files_2 = find_nbr_of_files(EXAMPLE_DIR, extension='txt')
     assert n_files_2 == 4
 
+def test_find_nbr_of_files_changes():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        open(join(tmp_dir, "a.txt"), "w").close()
+        assert find_nbr_of_files(tmp_dir, extension="txt") == 1
+        assert find_nbr_of_files(tmp_dir, extension="txt") == 1
+        open(join(tmp_dir, "b.txt"), "w").close()
+        assert find_nbr_of_files(tmp_dir, extension="txt") == 2
+        os.symlink(join(tmp_dir, "a.txt"), join(tmp_dir, "c.txt"))
+        os.mkdir(join(tmp_dir, "d.txt"))
+        assert find_nbr_of_files(tmp_dir, extension="txt") == 3
+
+def test_find_nbr_of_files_cache():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        open(join(tmp_dir, "a.txt"), "w").close()
+        old = time.time() - 3600
+        os.utime(tmp_dir, (old, old))
+        assert find_nbr_of_files(tmp_dir) == 1
+        open(join(tmp_dir, "b.txt"), "w").close()
+        os.utime(tmp_dir, (old, old))  # Modification time left unchanged, count is cached
+        assert find_nbr_of_files(tmp_dir) == 1
+
+        # Recently modified directories are always rescanned
+        os.utime(tmp_dir)
+        assert find_nbr_of_files(tmp_dir) == 2
+        mtime_ns = os.stat(tmp_dir).st_mtime_ns
+        open(join(tmp_dir, "c.txt"), "w").close()
+        os.utime(tmp_dir, ns=(mtime_ns, mtime_ns))
+        assert find_nbr_of_files(tmp_dir) == 3
+
 def test_list_files():
     files_gt = ["file1.txt", "file2.txt", "file3.txt", "file4.txt", "file5.file"]
     files_1 = list_files(EXAMPLE_DIR)
@@ -21,6 +63,11 @@ def test_list_files():
     assert set(files_3) == set(files_gt[:-1])
     files_4 = list_files(EXAMPLE_DIR, extension="txt", include_dir=True)
     assert set(files_4) == set([join(EXAMPLE_DIR, file) for file in files_gt[:-1]])
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        open(join(tmp_dir, "a.txt"), "w").close()
+        os.symlink(join(tmp_dir, "a.txt"), join(tmp_dir, "b.txt"))
+        os.mkdir(join(tmp_dir, "c.txt"))
+        assert set(list_files(tmp_dir)) == {"a.txt", "b.txt"}
 
 def test_list_files_recursive():
     files_gt = ["file1.txt", "file2.txt", "file3.txt", "file4.txt", "file5.file", \
@@ -35,4 +82,189 @@ def test_list_files_recursive():
     files_4 = list_files_recursive(EXAMPLE_DIR, extension=("txt", "file"))
     assert set(files_4) == set([file for file in files_gt if ((file.endswith("txt")) or (file.endswith("file")))])
     files_5 = list_files_recursive(EXAMPLE_DIR, extension=["txt", "file"])
-    assert set(files_5) == set([file for file in files_gt if ((file.endswith("txt")) or (file.endswith("file")))])
\ No newline at end of file
+    assert set(files_5) == set([file for file in files_gt if ((file.endswith("txt")) or (file.endswith("file")))])
+
+def test_iter_files_recursive():
+    files = iter_files_recursive(EXAMPLE_DIR, extension="file")
+    assert not isinstance(files, list)
+    assert set(files) == set(["file5.file", "subdirectory"+os.sep+"subsubdirectory"+os.sep+"file1.file"])
+    files_sorted = list_files_recursive(EXAMPLE_DIR, sort=True)
+    assert files_sorted == sorted(list_files_recursive(EXAMPLE_DIR))
+
+def test_list_files_recursive_workers(monkeypatch):
+    files_1 = list_files_recursive(EXAMPLE_DIR, workers=4)
+    assert set(files_1) == set(list_files_recursive(EXAMPLE_DIR))
+    # Many directories below a single top-level directory are still scanned in threads
+    executors = []
+    def recording_executor(**kwargs):
+        executors.append(kwargs)
+        return ThreadPoolExecutor(**kwargs)
+    monkeypatch.setattr(base_utils, "ThreadPoolExecutor", recording_executor)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for i in range(6):
+            os.makedirs(join(tmp_dir, "data", str(i), "sub"))
+            for path in [join(tmp_dir, "data", str(i), "a.txt"), join(tmp_dir, "data", str(i), "sub", "b.txt")]:
+                open(path, "w").close()
+        files_2 = list_files_recursive(tmp_dir, extension="txt", workers=4)
+        assert len(files_2) == 12
+        assert set(files_2) == set(list_files_recursive(tmp_dir, extension="txt"))
+        assert executors == [{"max_workers": 4}]
+
+def test_change_num_format():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for filename in ["1.txt", "22.txt", "name.txt", "3.png"]:
+            open(join(tmp_dir, filename), "w").close()
+        change_num_format(tmp_dir, extension=".txt", n_leading_zeros=4)
+        assert set(os.listdir(tmp_dir)) == {"0001.txt", "0022.txt", "name.txt", "3.png"}
+
+def test_add_file_to_directory():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        open(join(tmp_dir, "00002.txt"), "w").close()
+        add_file_to_directory("a", tmp_dir, lambda path, var: save_txt(var, path), ".txt")
+        open(join(tmp_dir, "00004.txt"), "w").close()  # Added behind the back of the cached index
+        add_file_to_directory("b", tmp_dir, lambda path, var: save_txt(var, path), ".txt")
+        assert sorted(os.listdir(tmp_dir)) == ["00002.txt", "00003.txt", "00004.txt", "00005.txt"]
+        with open(join(tmp_dir, "00005.txt")) as f:
+            assert f.read() == "b"
+        umask = os.umask(0)
+        os.umask(umask)
+        assert stat.S_IMODE(os.stat(join(tmp_dir, "00005.txt")).st_mode) == 0o666 & ~umask
+
+        def failing_write(path, var):
+            raise RuntimeError
+        with pytest.raises(RuntimeError):
+            add_file_to_directory("c", tmp_dir, failing_write, ".txt")
+        assert not os.path.exists(join(tmp_dir, "00006.txt"))
+        add_file_to_directory("c", tmp_dir, lambda path, var: save_txt(var, path), ".txt")
+        assert load_txt(join(tmp_dir, "00006.txt")) == "c"
+
+def test_save_to_removed_directory():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sub_dir = join(tmp_dir, "sub")
+        save_txt("a", join(sub_dir, "a.txt"))
+        shutil.rmtree(sub_dir)
+        save_txt("b", join(sub_dir, "b.txt"))
+        assert load_txt(join(sub_dir, "b.txt")) == "b"
+
+        clocker = Clocker(sub_dir)
+        shutil.rmtree(sub_dir)
+        clocker.clock("target")
+        clocker.stop_clock()
+        clocker.close()
+        assert os.path.isfile(join(sub_dir, "target.txt"))
+
+def test_pickle_large():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = join(tmp_dir, "large.pkl")
+        var = np.arange(_MMAP_THRESHOLD // 8 + 1, dtype=np.float64)
+        save_pickle(var, path)
+        assert os.path.getsize(path) >= _MMAP_THRESHOLD  # Loaded through mmap
+        loaded = load_pickle(path)
+        assert np.array_equal(loaded, var)
+        assert loaded.flags.writeable
+        loaded[0] = -1.0
+
+def test_pickle_gzip():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = join(tmp_dir, "var.pkl.gz")
+        var = {"a": list(range(1000)), "b": "text"}
+        save_pickle(var, path)
+        with open(path, "rb") as f:
+            assert f.read(2) == b"\x1f\x8b"
+        assert load_pickle(path) == var
+
+def test_index_files():
+    for n_workers in [1, 4]:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # 000001.jpg is both a file to rename and the target name of 1.jpg
+            for filename in ["1.jpg", "000001.jpg", "7.jpg", "foo_jpg", "a.png"]:
+                save_txt(filename, join(tmp_dir, filename))
+            index_files(tmp_dir, "jpg", n_leading_zeros=6, n_workers=n_workers)
+            assert set(os.listdir(tmp_dir)) == {"000000.jpg", "000001.jpg", "000002.jpg", "foo_jpg", "a.png"}
+            assert load_txt(join(tmp_dir, "000000.jpg")) == "000001.jpg"
+            assert load_txt(join(tmp_dir, "000001.jpg")) == "1.jpg"
+            assert load_txt(join(tmp_dir, "000002.jpg")) == "7.jpg"
+
+def test_index_files_without_dir_fd(monkeypatch):
+    monkeypatch.setattr(os, "supports_dir_fd", set())
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for filename in ["1.jpg", "000001.jpg"]:
+            save_txt(filename, join(tmp_dir, filename))
+        index_files(tmp_dir, "jpg", n_leading_zeros=6, n_workers=2)
+        assert load_txt(join(tmp_dir, "000000.jpg")) == "000001.jpg"
+        assert load_txt(join(tmp_dir, "000001.jpg")) == "1.jpg"
+
+def test_index_files_failure():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for filename in ["1.jpg", "000001.jpg", "7.jpg"]:
+            save_txt(filename, join(tmp_dir, filename))
+        save_txt("", join(tmp_dir, "000002.jpg", "blocker"))  # Target name of 7.jpg is taken by a directory
+        with pytest.raises(OSError):
+            index_files(tmp_dir, "jpg", n_leading_zeros=6)
+        assert set(os.listdir(tmp_dir)) == {"000000.jpg", "000001.jpg", "000002.jpg", "7.jpg"}
+        assert load_txt(join(tmp_dir, "7.jpg")) == "7.jpg"
+
+def test_cache():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        calls = []
+
+        @cache(cache_dir=Path(tmp_dir))
+        def square(x):
+            calls.append(x)
+            return x * x
+
+        assert square(3) == 9
+        assert square(3) == 9  # Loaded from disk
+        assert calls == [3]
+        assert len(os.listdir(join(tmp_dir, "square"))) == 1
+
+        # The cache directory is recreated if removed
+        shutil.rmtree(join(tmp_dir, "square"))
+        assert square(3) == 9
+        assert calls == [3, 3]
+        assert len(os.listdir(join(tmp_dir, "square"))) == 1
+
+def test_cache_failing_dump():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        def failing_dump(output, f):
+            f.write(b"partial")
+            raise RuntimeError
+
+        @cache(cache_dir=Path(tmp_dir), dump_fn=failing_dump)
+        def square(x):
+            return x * x
+
+        with pytest.raises(RuntimeError):
+            square(3)
+        assert os.listdir(join(tmp_dir, "square")) == []
+
+def test_cache_memory():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        loads = []
+
+        def counting_load(f):
+            loads.append(1)
+            return pickle.load(f)
+
+        @cache(cache_dir=Path(tmp_dir), load_fn=counting_load, memory_size=2)
+        def make_list(x):
+            return [x]
+
+        outputs = [make_list(x) for x in [1, 2, 3]]
+        assert make_list(3) is outputs[2]
+        assert make_list(2) is outputs[1]
+        assert len(loads) == 0
+        # 1 was evicted when 3 was added, so it's loaded from disk
+        assert make_list(1) == [1]
+        assert make_list(1) is not outputs[0]
+        assert len(loads) == 1
+
+        # Without memory_size, every hit returns a fresh object
+        @cache(cache_dir=Path(tmp_dir), cache_id="make_list_default")
+        def make_list_default(x):
+            return [x]
+
+        first = make_list_default(1)
+        first.append(2)
+        assert make_list_default(1) == [1]
+        assert make_list_default(1) is not make_list_default(1)
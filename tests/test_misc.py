@@ -1,15 +1,24 @@
-from os.path import join
+from os.path import join, isfile
 import time
 from time import sleep
 import tempfile
+import pickle
 import pytest
 
 import numpy as np
 
 from barktools.base_utils import RingBuffer
 from barktools.base_utils import Clocker
+from barktools.base_utils import Stopwatch
 from barktools.base_utils import generate_name
+from barktools.base_utils import base36encode
+from barktools.base_utils import remove_extension
+from barktools.base_utils import downsample_skip
+from barktools.base_utils import get_selected_data
+from barktools.base_utils import simple_hash_fun
+from barktools.io_utils import _pack, _unpack
 from barktools.compute_utils import bind_angle, bind_angle_degrees, angular_diff, angular_diff_degrees
+from barktools.compute_utils import MultiBaseNumber
 
 from tests.test_helper import TMP_DIR
 
@@ -31,6 +40,20 @@ class TestRingBuffer:
             ring_buffer.put(item)
         assert ring_buffer.last() == 4  
 
+    def test_dtype(self):
+        ring_buffer = RingBuffer(buffer_size=3, dtype='d')
+        assert ring_buffer.items() == [None, None, None]
+        assert ring_buffer.last() is None
+        ring_buffer.put(0.5)
+        assert ring_buffer.items() == [0.5, None, None]
+        assert ring_buffer.n_last(2) == [None, 0.5]
+        ring_buffer = RingBuffer(buffer_size=3, dtype='d')
+        for item in [0.5, 1.5, 2.5, 3.5]:
+            ring_buffer.put(item)
+        assert ring_buffer.items() == [3.5, 1.5, 2.5]
+        assert ring_buffer.n_last(2) == [2.5, 3.5]
+        assert ring_buffer.last() == 3.5
+
 class TestClocker:
 
     def test_1(self):
@@ -70,11 +93,108 @@ class TestClocker:
             milli_times_mean = sum(milli_times)/len(milli_times)
             assert abs(milli_times_mean-0.001) <  mean_milli_tol
 
+    def test_flush_threshold(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            clocker = Clocker(tmp_dir, 'target', flush_threshold=None)
+            for _ in range(100):
+                clocker.clock('target')
+            clocker.stop_clock()
+            path = join(tmp_dir, "target.txt")
+            assert not isfile(path)
+            clocker.close()
+            with open(path, 'r') as file:
+                assert len(file.readlines()) == 100
+
+class TestStopwatch:
+
+    def test_1(self):
+        s = Stopwatch()
+        assert s.elapsed_ns() == 0
+        s.start()
+        sleep(0.01)
+        elapsed = s.stop()
+        assert isinstance(s.elapsed_ns(), int)
+        assert elapsed == s.elapsed() == s.elapsed_ns() / 1e9
+        assert elapsed >= 0.01
+        assert s.reset() == elapsed
+        assert s.elapsed() == 0
+
+
+class TestMultiBaseNumber:
+
+    def test_base_10(self):
+        number = MultiBaseNumber([2,2,3,4], [1,0,2,0])
+        assert number.base_10() == 32
+        number.digits[3] = 3
+        assert number.base_10() == 35
+        assert MultiBaseNumber([1000]*10, [999]*10).base_10() == 10**30 - 1
+
+    def test_base_10_batch(self):
+        number = MultiBaseNumber([2,2,3,4])
+        all_digits = [list(n.digits) for n in number]
+        assert number.base_10_batch(all_digits).tolist() == list(range(2*2*3*4))
+
+    def test_iteration(self):
+        number = MultiBaseNumber([2,1,3])
+        values = [n.base_10() for n in number]
+        assert values == list(range(6))
+        assert number.digits == [0,0,0]
+        number = MultiBaseNumber((2,3), (0,1))
+        assert number.increment() and number.digits == [0,2]
+        assert MultiBaseNumber([2,3], [1,0]) > MultiBaseNumber([2,3], [0,2])
+        assert MultiBaseNumber([2,3], [1,0]) == MultiBaseNumber([3,2], [1,1])
+
 def test_generate_name():
     names = []
     for _ in range(10000):
         names.append(generate_name())
 
+def test_base36encode():
+    assert base36encode(0) == "0"
+    assert base36encode(35) == "z"
+    assert base36encode(36) == "10"
+    assert int(base36encode(10**40), 36) == 10**40
+
+def test_remove_extension():
+    assert remove_extension("file.txt") == "file"
+    assert remove_extension("archive.tar.gz") == "archive.tar"
+    assert remove_extension("no_extension") == "no_extension"
+
+def test_downsample_skip():
+    a, b, c = downsample_skip(2, [1,2,3,4], ('a','b','c','d'), np.arange(4))
+    assert a == [1,3]
+    assert b == ('a','c')
+    assert np.array_equal(c, [0,2])
+
+def test_simple_hash_fun():
+    assert simple_hash_fun("a", b=1) == simple_hash_fun("a", b=1)
+    assert simple_hash_fun(b"abc") != simple_hash_fun("abc")
+    assert simple_hash_fun("a=1") != simple_hash_fun(a=1)
+    assert simple_hash_fun("a§b") != simple_hash_fun("a", "b")
+    assert simple_hash_fun("ab") != simple_hash_fun("a", "b")
+
+def test_pack():
+    array = np.arange(12, dtype=np.float32).reshape(3, 4)
+    fortran_array = np.asfortranarray(array)
+    d = {"a": 1, "b": [1.0, "c"]}
+    for obj in [array, fortran_array]:
+        unpacked = _unpack(_pack(obj))
+        assert np.array_equal(unpacked, obj)
+        assert unpacked.flags.f_contiguous == obj.flags.f_contiguous
+        assert unpacked.flags.writeable
+    assert _unpack(_pack(d)) == d
+    # Payloads from before the framing was added are plain pickles
+    assert _unpack(pickle.dumps(d)) == d
+
+def test_get_selected_data():
+    a, b, c = get_selected_data([2,0], [1,2,3], ('a','b','c'), np.arange(3))
+    assert a == [3,1]
+    assert b == ['c','a']
+    assert np.array_equal(c, [2,0])
+    assert get_selected_data([1], [1,2,3]) == ([2],)
+    assert get_selected_data([], [1,2,3]) == ([],)
+    assert np.array_equal(get_selected_data((2,0), np.arange(3))[0], [2,0])
+
 def test_bind_angles():
     deg2rad = np.pi/180.0
     assert bind_angle(10*deg2rad, 0) == pytest.approx(10*deg2rad)